@@ -0,0 +1,11 @@
+-- Migration: Add content hash to chunks for embedding reuse
+-- Chunks with identical content (repeated headers, TOC, slides) can copy an
+-- existing embedding instead of calling the Gemini API again
+
+-- Add SHA-256 digest of chunk content
+ALTER TABLE chunks ADD COLUMN IF NOT EXISTS content_sha256 BYTEA;
+
+-- Not UNIQUE: duplicate content across chunks is exactly what gets reused
+CREATE INDEX IF NOT EXISTS idx_chunks_content_sha256 ON chunks(content_sha256);
+
+COMMENT ON COLUMN chunks.content_sha256 IS 'SHA-256 of chunk content, used to reuse embeddings of identical chunks';
@@ -0,0 +1,50 @@
+-- Migration: Store chunk embeddings as halfvec (FP16)
+-- Halves the storage of every embedding (3 KB -> 1.5 KB per row) and of the
+-- ANN index, so similarity scans move half the bytes
+-- Requires pgvector 0.7.0+ (halfvec type and HNSW index support)
+-- Run after migration_add_content_hash.sql
+
+-- Drop the FP32 index before converting the column
+DROP INDEX IF EXISTS idx_chunks_embedding;
+
+-- Convert existing embeddings to half precision
+ALTER TABLE chunks ALTER COLUMN embedding TYPE halfvec(768) USING embedding::halfvec(768);
+
+-- The halfvec HNSW index is built by migration_hnsw_retrieval_indexes.sql,
+-- which must be run next
+
+-- Recreate similarity search for halfvec queries
+DROP FUNCTION IF EXISTS match_chunks(vector, INT, INT);
+
+CREATE OR REPLACE FUNCTION match_chunks(
+    query_embedding halfvec(768),
+    match_count INT DEFAULT 5,
+    filter_document INT DEFAULT NULL
+)
+RETURNS TABLE (
+    id INT,
+    document_id INT,
+    content TEXT,
+    chunk_index INTEGER,
+    similarity FLOAT
+)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    RETURN QUERY
+    SELECT
+        chunks.id,
+        chunks.document_id,
+        chunks.content,
+        chunks.chunk_index,
+        1 - (chunks.embedding <=> query_embedding) AS similarity
+    FROM chunks
+    WHERE (filter_document IS NULL OR chunks.document_id = filter_document)
+        AND embedding IS NOT NULL
+        AND status = 'embedded'
+    ORDER BY chunks.embedding <=> query_embedding
+    LIMIT match_count;
+END;
+$$;
+
+COMMENT ON FUNCTION match_chunks IS 'Semantic similarity search using cosine distance';
@@ -0,0 +1,10 @@
+-- Migration: Tune the HNSW index used by match_chunks retrieval
+-- Only embedded chunks are searchable, so the index skips rows without
+-- an embedding.
+-- Run after migration_halfvec_embeddings.sql
+
+-- Rebuild the HNSW index as a partial index with explicit build parameters
+DROP INDEX IF EXISTS idx_chunks_embedding;
+CREATE INDEX IF NOT EXISTS idx_chunks_embedding_hnsw ON chunks
+    USING hnsw (embedding halfvec_cosine_ops) WITH (m = 16, ef_construction = 64)
+    WHERE embedding IS NOT NULL;
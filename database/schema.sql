@@ -1,5 +1,5 @@
 -- TutorAI Database Schema
--- PostgreSQL 14+ with pgvector extension
+-- PostgreSQL 14+ with pgvector 0.7.0+ extension (halfvec)
 
 -- Enable pgvector extension
 CREATE EXTENSION IF NOT EXISTS vector;
@@ -44,12 +44,13 @@ CREATE INDEX idx_documents_status ON documents(status);
 CREATE INDEX idx_documents_uploaded_by ON documents(uploaded_by);
 CREATE INDEX idx_documents_created_at ON documents(created_at DESC);
 
--- Chunks table with vector embeddings (768-dimensional for Gemini)
+-- Chunks table with half-precision vector embeddings (768-dimensional for Gemini)
 CREATE TABLE chunks (
     id SERIAL PRIMARY KEY,
     document_id INTEGER REFERENCES documents(id) ON DELETE CASCADE,
     content TEXT NOT NULL,
-    embedding vector(768),
+    content_sha256 BYTEA, -- SHA-256 of content, used to reuse embeddings of identical chunks
+    embedding halfvec(768),
     chunk_index INTEGER NOT NULL,
     status TEXT DEFAULT 'pending' CHECK (status IN ('pending', 'embedded', 'failed')),
     error_message TEXT,
@@ -61,8 +62,11 @@ CREATE TABLE chunks (
 CREATE INDEX idx_chunks_document_id ON chunks(document_id);
 CREATE INDEX idx_chunks_status ON chunks(status);
 CREATE INDEX idx_chunks_document_status ON chunks(document_id, status);
--- IVFFlat index for fast similarity search
-CREATE INDEX idx_chunks_embedding ON chunks USING ivfflat (embedding vector_cosine_ops) WITH (lists = 100);
+CREATE INDEX idx_chunks_content_sha256 ON chunks(content_sha256);
+-- HNSW index for fast similarity search (only embedded chunks are searchable)
+CREATE INDEX idx_chunks_embedding_hnsw ON chunks
+    USING hnsw (embedding halfvec_cosine_ops) WITH (m = 16, ef_construction = 64)
+    WHERE embedding IS NOT NULL;
 
 -- Chat history table
 CREATE TABLE chat_history (
@@ -95,7 +99,7 @@ CREATE INDEX idx_feedback_rating ON feedback(rating);
 
 -- Function for similarity search using cosine similarity
 CREATE OR REPLACE FUNCTION match_chunks(
-    query_embedding vector(768),
+    query_embedding halfvec(768),
     match_count INT DEFAULT 5,
     filter_document INT DEFAULT NULL
 )
@@ -137,7 +141,7 @@ INSERT INTO profiles (email, password_hash, name, role) VALUES
 
 COMMENT ON TABLE profiles IS 'User profiles with JWT authentication';
 COMMENT ON TABLE documents IS 'Uploaded PDF documents for RAG';
-COMMENT ON TABLE chunks IS 'Text chunks with Gemini embeddings (768-dim). Status: pending (chunked, waiting for embedding), embedded (completed), failed (embedding error)';
+COMMENT ON TABLE chunks IS 'Text chunks with Gemini embeddings (768-dim, halfvec). Status: pending (chunked, waiting for embedding), embedded (completed), failed (embedding error)';
 COMMENT ON TABLE chat_history IS 'User chat conversations with AI';
 COMMENT ON TABLE feedback IS 'User feedback on chat responses (thumbs up/down)';
 COMMENT ON FUNCTION match_chunks IS 'Semantic similarity search using cosine distance';
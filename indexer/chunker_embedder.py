@@ -3,9 +3,18 @@ Chunker and Embedder module for TutorAI
 Handles semantic text chunking and Gemini API embedding generation
 """
 
+import asyncio
+import functools
 import re
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Tuple
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+from tenacity import (
+    retry,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_random_exponential,
+)
 import os
 from dotenv import load_dotenv
 from langchain_text_splitters import (
@@ -24,13 +33,36 @@ if not GEMINI_API_KEY:
 genai.configure(api_key=GEMINI_API_KEY)
 
 # Download NLTK data for semantic chunking (if not already downloaded)
+# (NLTK 3.9 sentence tokenization loads punkt_tab)
 try:
-    nltk.data.find("tokenizers/punkt")
+    nltk.data.find("tokenizers/punkt_tab")
 except LookupError:
     nltk.download("punkt", quiet=True)
     nltk.download("punkt_tab", quiet=True)
 
 
+# Characters kept by clean_text: word characters, whitespace and punctuation.
+# Pure-ASCII text (the common case) is filtered with str.translate instead
+# of a regex; other text falls back to the equivalent regex
+_KEEP_CHARS = r"\w\s.,!?;:()\-\'\""
+_SPECIAL_CHARS_RE = re.compile(rf"[^{_KEEP_CHARS}]+")
+_ASCII_DELETE_TABLE = dict.fromkeys(
+    i for i in range(128) if not re.match(rf"[{_KEEP_CHARS}]", chr(i))
+)
+
+# Page numbers (common pattern: Page X, p. X, etc.)
+_PAGE_NUMBER_RE = re.compile(r"\b[Pp]age\s+\d+\b|\bp\.\s*\d+\b")
+
+# Sentence terminators used by the fallback chunker to pick a break point
+_SENTENCE_END_RE = re.compile(r"[.!?\n]")
+
+# Sentence boundary in cleaned text, used to cut the streaming buffer
+_SENTENCE_BOUNDARY_RE = re.compile(r"[.!?] ")
+
+# Number of chunks' worth of text iter_chunk_batches buffers before splitting
+STREAM_WINDOW_CHUNKS = 10
+
+
 def clean_text(text: str) -> str:
     """
     Clean and preprocess text before chunking
@@ -41,20 +73,86 @@ def clean_text(text: str) -> str:
     Returns:
         Cleaned text
     """
-    # Remove excessive whitespace
-    text = re.sub(r"\s+", " ", text)
-
     # Remove special characters but keep punctuation
-    text = re.sub(r"[^\w\s.,!?;:()\-\'\"]+", "", text)
+    if text.isascii():
+        text = text.translate(_ASCII_DELETE_TABLE)
+    else:
+        text = _SPECIAL_CHARS_RE.sub("", text)
+
+    # Collapse excessive whitespace (str.split splits on the same chars as \s)
+    text = " ".join(text.split())
+
+    # Remove page numbers and trim whitespace
+    return _PAGE_NUMBER_RE.sub("", text).strip()
+
+
+def _find_chunk_spans(
+    text: str, chunk_size: int, overlap: int
+) -> List[Tuple[int, int]]:
+    """
+    Compute (start, end) offsets for simple overlap chunking
+
+    Each chunk is extended to the first sentence terminator within 100 chars
+    past chunk_size, and the next chunk starts overlap chars before its end.
 
-    # Remove page numbers (common pattern: Page X, p. X, etc.)
-    text = re.sub(r"\b[Pp]age\s+\d+\b", "", text)
-    text = re.sub(r"\bp\.\s*\d+\b", "", text)
+    Args:
+        text: Cleaned input text
+        chunk_size: Target size of each chunk in characters
+        overlap: Number of overlapping characters between chunks
+
+    Returns:
+        List of (start_char, end_char) tuples
+    """
+    spans = []
+    start = 0
+    text_length = len(text)
+
+    while start < text_length:
+        end = start + chunk_size
+
+        # Try to break at sentence boundary (within the next 100 chars)
+        if end < text_length:
+            boundary = _SENTENCE_END_RE.search(text, end, min(end + 100, text_length))
+            if boundary:
+                end = boundary.end()
+        else:
+            end = text_length
+
+        spans.append((start, end))
+
+        # Always move forward, even if overlap >= chunk_size
+        start = max(end - overlap, start + 1) if end < text_length else text_length
+
+    return spans
 
-    # Trim whitespace
-    text = text.strip()
 
-    return text
+@functools.lru_cache(maxsize=8)
+def _get_splitter(method: str, chunk_size: int, overlap: int):
+    """
+    Build the text splitter for a chunking configuration (cached, splitters are stateless)
+
+    Args:
+        method: Chunking method - 'semantic' (NLTK sentence-based) or 'recursive' (fallback)
+        chunk_size: Target size of each chunk in characters
+        overlap: Number of overlapping characters between chunks
+
+    Returns:
+        Configured langchain text splitter
+    """
+    if method == "semantic":
+        # Use NLTK-based semantic chunking (respects sentence boundaries)
+        return NLTKTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=overlap,
+        )
+
+    # Fallback to recursive character splitting
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=overlap,
+        separators=["\n\n", "\n", ". ", "! ", "? ", "; ", ", ", " ", ""],
+        length_function=len,
+    )
 
 
 def chunk_text(
@@ -73,29 +171,38 @@ def chunk_text(
         List of dicts containing chunk info: {content, chunk_index, start_char, end_char}
     """
     # Clean text first
-    text = clean_text(text)
+    contents, spans = _split_cleaned_text(clean_text(text), chunk_size, overlap, method)
+
+    return [
+        {
+            "content": content,
+            "chunk_index": chunk_index,
+            "start_char": start_char,
+            "end_char": end_char,
+        }
+        for chunk_index, (content, (start_char, end_char)) in enumerate(
+            zip(contents, spans)
+        )
+    ]
 
-    if not text:
-        return []
 
-    chunks = []
-    chunk_index = 0
+def _split_cleaned_text(
+    text: str, chunk_size: int, overlap: int, method: str
+) -> Tuple[List[str], List[Tuple[int, int]]]:
+    """
+    Split already-cleaned text into chunks (see chunk_text)
+
+    Returns:
+        Parallel lists of chunk contents and (start_char, end_char) spans
+    """
+    contents = []
+    spans = []
+
+    if not text:
+        return contents, spans
 
     try:
-        if method == "semantic":
-            # Use NLTK-based semantic chunking (respects sentence boundaries)
-            text_splitter = NLTKTextSplitter(
-                chunk_size=chunk_size,
-                chunk_overlap=overlap,
-            )
-        else:
-            # Fallback to recursive character splitting
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=chunk_size,
-                chunk_overlap=overlap,
-                separators=["\n\n", "\n", ". ", "! ", "? ", "; ", ", ", " ", ""],
-                length_function=len,
-            )
+        text_splitter = _get_splitter(method, chunk_size, overlap)
 
         # Split text into chunks
         chunk_texts = text_splitter.split_text(text)
@@ -107,66 +214,153 @@ def chunk_text(
             if not chunk_text:
                 continue
 
-            # Find position in original text
-            start_char = text.find(chunk_text, current_pos)
+            # Find position in original text. Chunks come out in order and the
+            # next one starts at most `overlap` chars before the previous end,
+            # so only a small window past current_pos needs to be searched
+            start_char = text.find(
+                chunk_text, current_pos, current_pos + len(chunk_text) + overlap + 16
+            )
             if start_char == -1:
                 start_char = current_pos
             end_char = start_char + len(chunk_text)
 
-            chunks.append(
-                {
-                    "content": chunk_text,
-                    "chunk_index": chunk_index,
-                    "start_char": start_char,
-                    "end_char": end_char,
-                }
-            )
-            chunk_index += 1
-            current_pos = end_char
+            contents.append(chunk_text)
+            spans.append((start_char, end_char))
+            current_pos = max(start_char, end_char - overlap)
 
     except Exception as e:
         print(f"Error in semantic chunking: {e}")
         print("Falling back to simple chunking...")
 
         # Fallback to simple overlap chunking
-        start = 0
-        text_length = len(text)
+        contents = []
+        spans = []
+        for start_char, end_char in _find_chunk_spans(text, chunk_size, overlap):
+            chunk_content = text[start_char:end_char].strip()
 
-        while start < text_length:
-            end = start + chunk_size
+            if chunk_content:
+                contents.append(chunk_content)
+                spans.append((start_char, end_char))
 
-            # Try to break at sentence boundary
-            if end < text_length:
-                sentence_ends = [".", "!", "?", "\n"]
-                best_end = end
+    return contents, spans
 
-                for i in range(end, min(end + 100, text_length)):
-                    if text[i] in sentence_ends:
-                        best_end = i + 1
-                        break
 
-                end = best_end
-            else:
-                end = text_length
+def iter_chunk_batches(
+    pages: Iterable[str],
+    chunk_size: int = 1000,
+    overlap: int = 200,
+    method: str = "semantic",
+    batch_size: int = 500,
+) -> Iterator[Dict[str, List[Any]]]:
+    """
+    Lazily chunk a stream of page texts without building the full document string
 
-            chunk_content = text[start:end].strip()
+    Pages are cleaned as they arrive and appended to a rolling buffer. Once the
+    buffer holds STREAM_WINDOW_CHUNKS chunks' worth of text, it is cut at the
+    last sentence boundary, the head is split with chunk_text and the last
+    ~overlap chars (from a sentence start) are carried into the next window.
 
-            if chunk_content:
-                chunks.append(
-                    {
-                        "content": chunk_content,
-                        "chunk_index": chunk_index,
-                        "start_char": start,
-                        "end_char": end,
-                    }
-                )
-                chunk_index += 1
+    Args:
+        pages: Iterable of raw page texts (e.g. a generator over PDF pages)
+        chunk_size: Target size of each chunk in characters (default: 1000)
+        overlap: Number of overlapping characters between chunks (default: 200)
+        method: Chunking method - 'semantic' (NLTK sentence-based) or 'recursive' (fallback)
+        batch_size: Maximum number of chunks per yielded batch (default: 500)
 
-            start = end - overlap if end < text_length else text_length
+    Yields:
+        Batches of parallel lists: {contents, indices, spans} where spans are
+        (start_char, end_char) offsets into the concatenated cleaned text
+    """
+    window = chunk_size * STREAM_WINDOW_CHUNKS
+    buffer = ""
+    buffer_offset = 0  # Position of buffer[0] in the concatenated cleaned text
+    next_index = 0
+    contents = []
+    spans = []
+
+    def split(text: str) -> None:
+        window_contents, window_spans = _split_cleaned_text(
+            text, chunk_size, overlap, method
+        )
+        contents.extend(window_contents)
+        spans.extend(
+            (start_char + buffer_offset, end_char + buffer_offset)
+            for start_char, end_char in window_spans
+        )
 
-    return chunks
+    def take_batch(size: int) -> Dict[str, List[Any]]:
+        nonlocal next_index
+        batch = {
+            "contents": contents[:size],
+            "indices": list(range(next_index, next_index + size)),
+            "spans": spans[:size],
+        }
+        del contents[:size], spans[:size]
+        next_index += size
+        return batch
+
+    for page in pages:
+        page = clean_text(page)
+        if not page:
+            continue
+
+        buffer = f"{buffer} {page}" if buffer else page
+        if len(buffer) < window:
+            continue
+
+        # Cut after the last sentence boundary (or the last space if there is none)
+        boundary = buffer.rfind(" ", 0, len(buffer) - 1)
+        for match in _SENTENCE_BOUNDARY_RE.finditer(buffer, len(buffer) // 2):
+            boundary = match.end() - 1
+        if boundary <= 0:
+            continue
+
+        split(buffer[:boundary])
+        while len(contents) >= batch_size:
+            yield take_batch(batch_size)
+
+        # Carry the tail of the flushed text forward, starting at a sentence start
+        tail = _SENTENCE_BOUNDARY_RE.search(buffer, max(boundary - overlap, 0), boundary)
+        carry_start = tail.end() if tail else boundary + 1
+
+        buffer_offset += carry_start
+        buffer = buffer[carry_start:]
+
+    split(buffer)
+    while contents:
+        yield take_batch(min(batch_size, len(contents)))
+
+
+# Transient Gemini API errors (rate limit, 5xx, timeouts) that are worth retrying
+TRANSIENT_GEMINI_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+    asyncio.TimeoutError,
+    TimeoutError,
+)
 
 
+def _log_retry(retry_state) -> None:
+    """Log a transient Gemini error before backing off"""
+    print(
+        f"Transient Gemini error (attempt {retry_state.attempt_number}): "
+        f"{retry_state.outcome.exception()}, retrying..."
+    )
+
+
+# Exponential backoff with full jitter, so parallel workers don't retry in lockstep
+retry_transient = retry(
+    stop=stop_after_attempt(5),
+    wait=wait_random_exponential(min=0.5, max=8),
+    retry=retry_if_exception_type(TRANSIENT_GEMINI_ERRORS),
+    before_sleep=_log_retry,
+    reraise=True,
+)
+
+
+@retry_transient
 def embed_text(text: str, task_type: str = "retrieval_document") -> List[float]:
     """
     Generate embedding for a single text using Gemini API
@@ -193,36 +387,145 @@ def embed_text(text: str, task_type: str = "retrieval_document") -> List[float]:
         raise
 
 
-def embed_batches(
-    texts: List[str], task_type: str = "retrieval_document", batch_size: int = 100
+@retry_transient
+async def _aembed_one(
+    sem: asyncio.Semaphore, text: str, task_type: str = "retrieval_document"
+) -> List[float]:
+    """
+    Generate embedding for a single text without blocking the event loop
+
+    Args:
+        sem: Semaphore bounding the number of in-flight Gemini requests
+        text: Input text to embed
+        task_type: Type of embedding task
+
+    Returns:
+        768-dimensional embedding vector
+    """
+    async with sem:
+        result = await genai.embed_content_async(
+            model="models/gemini-embedding-001",
+            content=text,
+            task_type=task_type,
+            output_dimensionality=768,
+        )
+    return result["embedding"]
+
+
+@retry_transient
+async def _aembed_batch(
+    sem: asyncio.Semaphore, texts: List[str], task_type: str = "retrieval_document"
 ) -> List[List[float]]:
     """
-    Generate embeddings for multiple texts in batches
+    Generate embeddings for a batch of texts in a single batchEmbedContents call
+
+    Args:
+        sem: Semaphore bounding the number of in-flight Gemini requests
+        texts: Texts to embed (Gemini limit: 100 per request)
+        task_type: Type of embedding task
+
+    Returns:
+        List of 768-dimensional embedding vectors, in the same order as texts
+    """
+    async with sem:
+        result = await genai.embed_content_async(
+            model="models/gemini-embedding-001",
+            content=texts,
+            task_type=task_type,
+            output_dimensionality=768,
+        )
+    return result["embedding"]
+
+
+async def aembed_batches(
+    texts: List[str],
+    task_type: str = "retrieval_document",
+    batch_size: int = 100,
+    max_concurrency: int = 8,
+    return_exceptions: bool = False,
+) -> List[Any]:
+    """
+    Generate embeddings for multiple texts, one API call per batch, batches in parallel
 
     Args:
         texts: List of texts to embed
         task_type: Type of embedding task
-        batch_size: Number of texts to process at once (Gemini limit: ~100)
+        batch_size: Number of texts sent per request (Gemini limit: 100)
+        max_concurrency: Maximum number of in-flight Gemini requests (rate-limit guard)
+        return_exceptions: Return the exception in place of each embedding that
+                           fails instead of raising it. Batches rejected with a
+                           non-transient error are retried text by text first
 
     Returns:
-        List of 768-dimensional embedding vectors
+        List of 768-dimensional embedding vectors, in the same order as texts
     """
-    embeddings = []
+    sem = asyncio.Semaphore(max_concurrency)
+    batches = [texts[i : i + batch_size] for i in range(0, len(texts), batch_size)]
+    results = await asyncio.gather(
+        *[_aembed_batch(sem, batch, task_type) for batch in batches],
+        return_exceptions=return_exceptions,
+    )
+
+    # Retry failed batches text by text so one bad input doesn't fail the rest.
+    # Transient errors were already retried by _aembed_batch; fanning out while
+    # rate-limited would only multiply requests, so those fail the whole batch
+    failed = []
+    for i, result in enumerate(results):
+        if isinstance(result, TRANSIENT_GEMINI_ERRORS):
+            results[i] = [result] * len(batches[i])
+        elif isinstance(result, Exception):
+            failed.append(i)
+
+    if failed:
+        print(f"{len(failed)} batch(es) failed, embedding their texts individually...")
+        retried = await asyncio.gather(
+            *[
+                asyncio.gather(
+                    *[_aembed_one(sem, text, task_type) for text in batches[i]],
+                    return_exceptions=True,
+                )
+                for i in failed
+            ]
+        )
+        for i, result in zip(failed, retried):
+            results[i] = result
 
-    for i in range(0, len(texts), batch_size):
-        batch = texts[i : i + batch_size]
+    return [embedding for result in results for embedding in result]
 
-        try:
-            # Process batch
-            for text in batch:
-                embedding = embed_text(text, task_type)
-                embeddings.append(embedding)
 
-        except Exception as e:
-            print(f"Error processing batch {i}-{i+batch_size}: {e}")
-            raise
+def embed_batches(
+    texts: List[str],
+    task_type: str = "retrieval_document",
+    batch_size: int = 100,
+    max_concurrency: int = 8,
+    return_exceptions: bool = False,
+) -> List[Any]:
+    """
+    Generate embeddings for multiple texts in batches (sync wrapper)
+
+    Runs aembed_batches in a new event loop, so it is meant for scripts only.
+    The SDK caches its async client on the first loop it runs on, so code that
+    already has a running loop should await aembed_batches instead.
+
+    Args:
+        texts: List of texts to embed
+        task_type: Type of embedding task
+        batch_size: Number of texts sent per request (Gemini limit: 100)
+        max_concurrency: Maximum number of in-flight Gemini requests
+        return_exceptions: See aembed_batches
 
-    return embeddings
+    Returns:
+        List of 768-dimensional embedding vectors
+    """
+    try:
+        return asyncio.run(
+            aembed_batches(
+                texts, task_type, batch_size, max_concurrency, return_exceptions
+            )
+        )
+    except Exception as e:
+        print(f"Error embedding {len(texts)} texts: {e}")
+        raise
 
 
 def embed_query(query: str) -> List[float]:
@@ -238,6 +541,30 @@ def embed_query(query: str) -> List[float]:
     return embed_text(query, task_type="retrieval_query")
 
 
+async def aembed_query(query: str) -> List[float]:
+    """
+    Generate embedding for a search query without blocking the event loop
+
+    Transient errors are retried with asyncio.sleep backoff, so other requests
+    keep being served meanwhile (embed_query would block in time.sleep).
+
+    Args:
+        query: Search query text
+
+    Returns:
+        768-dimensional embedding vector
+    """
+    return await _aembed_one(asyncio.Semaphore(1), query, task_type="retrieval_query")
+
+
+# Build the default semantic splitter and load the NLTK punkt tokenizer at
+# import, so the first /index request doesn't pay for it
+try:
+    _get_splitter("semantic", 1000, 200).split_text("Warm up. Punkt is loaded.")
+except Exception as e:
+    print(f"Error warming up semantic splitter: {e}")
+
+
 if __name__ == "__main__":
     # Test chunking
     sample_text = """
@@ -6,25 +6,32 @@ FastAPI service for PDF processing, text chunking, embedding, and semantic retri
 from fastapi import FastAPI, HTTPException, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
-import psycopg2
+from typing import List, Optional, Dict, Any, Iterable, Iterator
 from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+from pgvector.psycopg2 import register_vector
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import numpy as np
+import hashlib
+import io
+import itertools
 import os
 from dotenv import load_dotenv
-import pypdf
 import tempfile
 import google.generativeai as genai
 
-# OCR Dependencies
-import pypdf
+# PDF / OCR Dependencies
+import pymupdf
 import pytesseract
 from pdf2image import convert_from_path
 from PIL import Image
 
 try:
-    from chunker_embedder import chunk_text, embed_batches, embed_query, embed_text
+    from chunker_embedder import iter_chunk_batches, aembed_batches, aembed_query
 except ImportError:
-    from .chunker_embedder import chunk_text, embed_batches, embed_query, embed_text
+    from .chunker_embedder import iter_chunk_batches, aembed_batches, aembed_query
 
 load_dotenv()
 
@@ -50,9 +57,61 @@ if not DATABASE_URL:
     raise ValueError("DATABASE_URL not found in environment variables")
 
 
+# Worker threads for the blocking database work of /embed batches
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "4"))
+embed_executor: Optional[ThreadPoolExecutor] = None
+
+# The pool closes a returned connection once DB_POOL_MIN_CONN are already idle,
+# so keep it at the expected concurrency (embed workers + /index + /retrieve)
+# or connections get reopened under load
+DB_POOL_MIN_CONN = int(os.getenv("DB_POOL_MIN_CONN", str(EMBED_WORKERS + 2)))
+DB_POOL_MAX_CONN = int(os.getenv("DB_POOL_MAX_CONN", "16"))
+
+# Number of chunks inserted per statement while streaming a document
+CHUNK_INSERT_BATCH_SIZE = 500
+
+# Flushes with at least this many chunks are inserted with COPY
+COPY_MIN_ROWS = 500
+
+# Shared connection pool, opened on startup so each request skips the
+# TCP/TLS/auth handshake of a fresh psycopg2.connect
+db_pool: Optional[ThreadedConnectionPool] = None
+
+
+@app.on_event("startup")
+def open_db_pool():
+    """Open the database connection pool and the embedding worker pool"""
+    global db_pool, embed_executor
+    db_pool = ThreadedConnectionPool(DB_POOL_MIN_CONN, DB_POOL_MAX_CONN, DATABASE_URL)
+
+    # Adapt numpy arrays to pgvector and parse halfvec columns into HalfVector
+    # (type OIDs are per database, so registering once covers every pooled connection)
+    with get_db_connection() as conn:
+        register_vector(conn, globally=True)
+
+    embed_executor = ThreadPoolExecutor(
+        max_workers=EMBED_WORKERS, thread_name_prefix="embed"
+    )
+
+
+@app.on_event("shutdown")
+def close_db_pool():
+    """Stop the embedding workers and close all pooled database connections"""
+    if embed_executor is not None:
+        embed_executor.shutdown(wait=True)
+    if db_pool is not None:
+        db_pool.closeall()
+
+
+@contextmanager
 def get_db_connection():
-    """Create and return a database connection"""
-    return psycopg2.connect(DATABASE_URL)
+    """Borrow a database connection from the pool and return it when done"""
+    conn = db_pool.getconn()
+    try:
+        yield conn
+    finally:
+        # Uncommitted work is rolled back (or the connection discarded) by the pool
+        db_pool.putconn(conn)
 
 
 # Pydantic models
@@ -115,11 +174,12 @@ def extract_text_with_ocr(file_path: str, dpi: int = 300) -> str:
 
         images = convert_from_path(file_path, dpi=dpi)
 
-        ocr_text = ""
+        page_texts = []
         for i, image in enumerate(images):
             print(f"Processing page {i+1}/{len(images)} with OCR...")
-            page_text = pytesseract.image_to_string(image, lang="eng+ind")
-            ocr_text += page_text + "\n"
+            page_texts.append(pytesseract.image_to_string(image, lang="eng+ind"))
+
+        ocr_text = "\n".join(page_texts) + "\n"
 
         print(f"OCR extraction complete: {len(ocr_text)} characters")
         return ocr_text
@@ -179,35 +239,51 @@ def extract_image_descriptions_from_pdf(file_path: str, dpi: int = 150) -> List[
         return []
 
 
-def extract_text_from_pdf(
+def iter_pdf_pages(
     file_path: str, use_ocr: bool = True, use_vision: bool = False
-) -> str:
+) -> Iterator[str]:
     """
-    Extract text from PDF with optional OCR and image description
+    Extract text from PDF page by page with optional OCR and image description
+
+    Pages are yielded as they are read so callers can chunk the document
+    without holding its full text in memory. The first pages are held back
+    only until enough text is seen to rule out the OCR fallback.
 
     Args:
         file_path: Path to PDF file
         use_ocr: Use OCR if normal extraction yields little text
         use_vision: Use Gemini Vision to describe images/diagrams
 
-    Returns:
-        Extracted text with optional image descriptions
+    Yields:
+        Page texts, followed by optional image descriptions
     """
-    pdf_text = ""
+    held_pages = []
+    extracted_chars = 0
 
     # Try normal text extraction first
+    # (PyMuPDF documents are not thread-safe, so pages are read sequentially)
     try:
-        with open(file_path, "rb") as pdf_file:
-            pdf_reader = pypdf.PdfReader(pdf_file)
-            for page in pdf_reader.pages:
-                pdf_text += page.extract_text() + "\n"
+        with pymupdf.open(file_path) as pdf_doc:
+            for page in pdf_doc:
+                page_text = page.get_text()
+
+                if use_ocr and extracted_chars < 100:
+                    held_pages.append(page_text)
+                    extracted_chars += len(page_text.strip())
+                    if extracted_chars >= 100:
+                        yield from held_pages
+                        held_pages = []
+                else:
+                    yield page_text
     except Exception as e:
         print(f"Error in normal PDF extraction: {e}")
 
     # If extracted text is too short, use OCR
-    if use_ocr and len(pdf_text.strip()) < 100:
+    if use_ocr and extracted_chars < 100:
         print("Text extraction yielded little content, switching to OCR...")
-        pdf_text = extract_text_with_ocr(file_path)
+        yield extract_text_with_ocr(file_path)
+    else:
+        yield from held_pages
 
     # Optionally add image descriptions
     if use_vision:
@@ -215,11 +291,64 @@ def extract_text_from_pdf(
         image_descriptions = extract_image_descriptions_from_pdf(file_path)
 
         if image_descriptions:
-            pdf_text += "\n\n=== Visual Content Descriptions ===\n"
-            pdf_text += "\n\n".join(image_descriptions)
+            yield "=== Visual Content Descriptions ===\n" + "\n\n".join(
+                image_descriptions
+            )
             print(f" Added {len(image_descriptions)} image descriptions")
 
-    return pdf_text
+
+def compute_content_hash(content: str) -> bytes:
+    """SHA-256 digest of chunk content, used to reuse embeddings of duplicate chunks"""
+    return hashlib.sha256(content.encode("utf-8")).digest()
+
+
+def _copy_escape(value: str) -> str:
+    """Escape a value for PostgreSQL COPY text format"""
+    return (
+        value.replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def insert_chunks(cursor, chunk_rows: Iterable[tuple], row_count: int) -> None:
+    """
+    Insert pending chunks in a single statement
+
+    Large flushes are streamed with COPY, which skips per-row INSERT parsing;
+    small ones use a multi-row INSERT.
+
+    Args:
+        cursor: Database cursor (caller commits)
+        chunk_rows: (document_id, content, chunk_index, status, content_sha256) tuples
+        row_count: Number of rows in chunk_rows
+    """
+    if row_count >= COPY_MIN_ROWS:
+        buffer = io.StringIO()
+        for document_id, content, chunk_index, status, content_sha256 in chunk_rows:
+            buffer.write(
+                f"{document_id}\t{_copy_escape(content)}\t{chunk_index}\t"
+                f"{status}\t\\\\x{content_sha256.hex()}\n"
+            )
+        buffer.seek(0)
+
+        cursor.copy_expert(
+            "COPY chunks (document_id, content, chunk_index, status, content_sha256) "
+            "FROM STDIN",
+            buffer,
+        )
+        return
+
+    execute_values(
+        cursor,
+        """
+        INSERT INTO chunks (document_id, content, chunk_index, status, content_sha256)
+        VALUES %s
+        """,
+        chunk_rows,
+        page_size=row_count,
+    )
 
 
 @app.get("/")
@@ -232,11 +361,8 @@ async def root():
 async def health_check():
     """Detailed health check with database connectivity"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1")
-        cursor.close()
-        conn.close()
+        with get_db_connection() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
 
         return {
             "status": "healthy",
@@ -262,14 +388,12 @@ async def index_document(request: IndexRequest):
     """
     try:
         # Update document status to processing
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        cursor.execute(
-            "UPDATE documents SET status = 'processing', updated_at = NOW() WHERE id = %s",
-            (request.document_id,),
-        )
-        conn.commit()
+        with get_db_connection() as conn, conn.cursor() as cursor:
+            cursor.execute(
+                "UPDATE documents SET status = 'processing', updated_at = NOW() WHERE id = %s",
+                (request.document_id,),
+            )
+            conn.commit()
 
         # Check if file exists
         if not os.path.exists(request.file_path):
@@ -277,64 +401,60 @@ async def index_document(request: IndexRequest):
                 status_code=404, detail=f"File not found: {request.file_path}"
             )
 
-        # Extract text from PDF WITH OCR and optional Vision (ONLY ONCE)
-        print(f"Extracting text from PDF: {request.file_path}")
-        pdf_text = extract_text_from_pdf(
+        # Stream PDF pages (WITH OCR and optional Vision) through the chunker and
+        # store chunks WITHOUT embeddings (status = 'pending') in flushes
+        print(f"Extracting and chunking PDF: {request.file_path}")
+        pages = iter_pdf_pages(
             request.file_path,
             use_ocr=True,
-            use_vision=request.use_vision,  # ← Single extraction call
+            use_vision=request.use_vision,
         )
 
-        if not pdf_text.strip():
+        # Each flush borrows a connection and commits on its own, so no pool slot
+        # or open transaction is held while pages are extracted (OCR, Vision);
+        # chunks of a document that fails midway are deleted in the handler below
+        chunks_created = 0
+        for batch in iter_chunk_batches(
+            pages,
+            chunk_size=1000,
+            overlap=200,
+            method="semantic",
+            batch_size=CHUNK_INSERT_BATCH_SIZE,
+        ):
+            contents = batch["contents"]
+            with get_db_connection() as conn, conn.cursor() as cursor:
+                insert_chunks(
+                    cursor,
+                    zip(
+                        itertools.repeat(request.document_id),
+                        contents,
+                        batch["indices"],
+                        itertools.repeat("pending"),  # Initial status
+                        map(compute_content_hash, contents),
+                    ),
+                    len(contents),
+                )
+                conn.commit()
+            chunks_created += len(contents)
+
+        if not chunks_created:
             raise HTTPException(
                 status_code=400, detail="No text extracted from PDF (tried OCR)"
             )
 
-        print(f"Extracted {len(pdf_text)} characters from PDF")
-
-        # Chunk text with semantic chunking
-        print("Chunking text with semantic splitting...")
-        chunks = chunk_text(pdf_text, chunk_size=1000, overlap=200, method="semantic")
-
-        if not chunks:
-            raise HTTPException(status_code=400, detail="No chunks created from text")
-
-        print(f"Created {len(chunks)} semantic chunks")
-
-        # Store chunks to database WITHOUT embeddings (status = 'pending')
-        print("Storing chunks to database...")
-        chunk_data = [
-            (
-                request.document_id,
-                chunks[i]["content"],
-                chunks[i]["chunk_index"],
-                "pending",  # Initial status
-            )
-            for i in range(len(chunks))
-        ]
-
-        execute_values(
-            cursor,
-            """
-            INSERT INTO chunks (document_id, content, chunk_index, status)
-            VALUES %s
-            """,
-            chunk_data,
-        )
+        print(f"Stored {chunks_created} semantic chunks")
 
         # Update document status to completed (chunking done)
-        cursor.execute(
-            """
-            UPDATE documents 
-            SET status = 'completed', updated_at = NOW() 
-            WHERE id = %s
-            """,
-            (request.document_id,),
-        )
-
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with get_db_connection() as conn, conn.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE documents 
+                SET status = 'completed', updated_at = NOW() 
+                WHERE id = %s
+                """,
+                (request.document_id,),
+            )
+            conn.commit()
 
         print(f"Successfully chunked document {request.document_id}")
         print(f"Note: Run /embed endpoint to generate embeddings for these chunks")
@@ -342,152 +462,258 @@ async def index_document(request: IndexRequest):
         return IndexResponse(
             success=True,
             document_id=request.document_id,
-            chunks_created=len(chunks),
-            message=f"Successfully chunked document with {len(chunks)} chunks. Run /embed to generate embeddings.",
+            chunks_created=chunks_created,
+            message=f"Successfully chunked document with {chunks_created} chunks. Run /embed to generate embeddings.",
         )
 
     except Exception as e:
         print(f"Error indexing document: {e}")
 
-        # Update document status to failed
+        # Drop chunks flushed before the failure and update document status to failed
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute(
-                """
-                UPDATE documents 
-                SET status = 'failed', error_message = %s, updated_at = NOW() 
-                WHERE id = %s
-                """,
-                (str(e), request.document_id),
-            )
-            conn.commit()
-            cursor.close()
-            conn.close()
+            with get_db_connection() as conn, conn.cursor() as cursor:
+                cursor.execute(
+                    "DELETE FROM chunks WHERE document_id = %s",
+                    (request.document_id,),
+                )
+                cursor.execute(
+                    """
+                    UPDATE documents 
+                    SET status = 'failed', error_message = %s, updated_at = NOW() 
+                    WHERE id = %s
+                    """,
+                    (str(e), request.document_id),
+                )
+                conn.commit()
         except Exception as db_error:
             print(f"Error updating document status: {db_error}")
 
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/embed")
-async def embed_pending_chunks(
-    document_id: Optional[int] = None, batch_size: int = 50, max_retries: int = 3
+def fetch_pending_chunks_sync(
+    cursor, document_id: Optional[int], batch_size: int, max_retries: int
 ):
     """
-    Generate embeddings for chunks with status 'pending' or 'failed'
+    Select and row-lock a batch of chunks to embed, run in embed_executor
 
-    Args:
-        document_id: Optional - process only chunks from specific document
-        batch_size: Number of chunks to process in one batch (default: 50)
-        max_retries: Maximum retry count for failed chunks (default: 3)
+    Selected chunks stay locked (SKIP LOCKED) until the caller commits, so
+    concurrent /embed calls work on disjoint chunks.
 
     Returns:
-        Status and statistics of embedding generation
+        (pending_chunks, content_hashes, embeddings_by_hash, contents_to_embed)
+        where embeddings_by_hash holds embeddings reused from identical chunks
+        and contents_to_embed maps each remaining hash to its content
     """
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+    # Get pending/failed chunks (with retry limit)
+    if document_id:
+        cursor.execute(
+            """
+            SELECT id, content, retry_count 
+            FROM chunks 
+            WHERE document_id = %s 
+              AND status IN ('pending', 'failed')
+              AND retry_count < %s
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+            """,
+            (document_id, max_retries, batch_size),
+        )
+    else:
+        cursor.execute(
+            """
+            SELECT id, content, retry_count 
+            FROM chunks 
+            WHERE status IN ('pending', 'failed')
+              AND retry_count < %s
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+            """,
+            (max_retries, batch_size),
+        )
 
-        # Get pending/failed chunks (with retry limit)
-        if document_id:
-            cursor.execute(
-                """
-                SELECT id, content, retry_count 
-                FROM chunks 
-                WHERE document_id = %s 
-                  AND status IN ('pending', 'failed')
-                  AND retry_count < %s
-                ORDER BY id
-                LIMIT %s
-                """,
-                (document_id, max_retries, batch_size),
-            )
+    pending_chunks = cursor.fetchall()
+
+    if not pending_chunks:
+        return pending_chunks, [], {}, {}
+
+    print(f"Processing {len(pending_chunks)} pending chunks...")
+
+    content_hashes = [
+        compute_content_hash(content) for _, content, _ in pending_chunks
+    ]
+
+    # Reuse embeddings of chunks with identical content
+    cursor.execute(
+        """
+        SELECT DISTINCT ON (content_sha256) content_sha256, embedding
+        FROM chunks
+        WHERE content_sha256 = ANY(%s) AND embedding IS NOT NULL
+        """,
+        (list(set(content_hashes)),),
+    )
+    embeddings_by_hash = {
+        bytes(content_hash): embedding.to_numpy()
+        for content_hash, embedding in cursor.fetchall()
+    }
+
+    # Distinct contents that still need an embedding
+    contents_to_embed = {}
+    for (_, content, _), content_hash in zip(pending_chunks, content_hashes):
+        if content_hash not in embeddings_by_hash:
+            contents_to_embed.setdefault(content_hash, content)
+
+    print(
+        f"Reusing {len(pending_chunks) - len(contents_to_embed)} cached embeddings, "
+        f"embedding {len(contents_to_embed)} new contents"
+    )
+
+    return pending_chunks, content_hashes, embeddings_by_hash, contents_to_embed
+
+
+def store_embedding_results_sync(
+    conn, cursor, pending_chunks, content_hashes, embeddings_by_hash
+) -> Dict[str, Any]:
+    """
+    Write embeddings (or errors) of a locked batch and commit, run in embed_executor
+    """
+    # Split results into successes and failures
+    embedded_rows = []
+    failed_rows = []
+    for (chunk_id, _, _), content_hash in zip(pending_chunks, content_hashes):
+        embedding = embeddings_by_hash[content_hash]
+        if isinstance(embedding, Exception):
+            print(f"Error embedding chunk {chunk_id}: {embedding}")
+            failed_rows.append((chunk_id, str(embedding)))
         else:
-            cursor.execute(
-                """
-                SELECT id, content, retry_count 
-                FROM chunks 
-                WHERE status IN ('pending', 'failed')
-                  AND retry_count < %s
-                ORDER BY id
-                LIMIT %s
-                """,
-                (max_retries, batch_size),
+            embedded_rows.append(
+                (chunk_id, np.asarray(embedding, dtype=np.float16), content_hash)
             )
 
-        pending_chunks = cursor.fetchall()
+    # Update all embedded chunks in one statement
+    if embedded_rows:
+        execute_values(
+            cursor,
+            """
+            UPDATE chunks 
+            SET embedding = v.embedding, 
+                content_sha256 = v.content_sha256,
+                status = 'embedded',
+                updated_at = NOW(),
+                error_message = NULL
+            FROM (VALUES %s) AS v(id, embedding, content_sha256)
+            WHERE chunks.id = v.id
+            """,
+            embedded_rows,
+            template="(%s, %s::halfvec, %s::bytea)",
+            page_size=len(embedded_rows),
+        )
 
-        if not pending_chunks:
-            cursor.close()
-            conn.close()
-            return {
-                "success": True,
-                "message": "No pending chunks to process",
-                "processed": 0,
-                "succeeded": 0,
-                "failed": 0,
-            }
+    # Mark failed chunks with retry count in one statement
+    if failed_rows:
+        execute_values(
+            cursor,
+            """
+            UPDATE chunks 
+            SET status = 'failed',
+                error_message = v.error_message,
+                retry_count = retry_count + 1,
+                updated_at = NOW()
+            FROM (VALUES %s) AS v(id, error_message)
+            WHERE chunks.id = v.id
+            """,
+            failed_rows,
+            page_size=len(failed_rows),
+        )
 
-        print(f"Processing {len(pending_chunks)} pending chunks...")
+    succeeded = len(embedded_rows)
+    failed = len(failed_rows)
+    failed_ids = [chunk_id for chunk_id, _ in failed_rows]
 
-        succeeded = 0
-        failed = 0
-        failed_ids = []
+    conn.commit()
 
-        # Process each chunk
-        for chunk_id, content, retry_count in pending_chunks:
-            try:
-                # Generate embedding
-                embedding = embed_text(content, task_type="retrieval_document")
+    print(f"Embedding complete: {succeeded} succeeded, {failed} failed")
 
-                # Update chunk with embedding
-                cursor.execute(
-                    """
-                    UPDATE chunks 
-                    SET embedding = %s::vector, 
-                        status = 'embedded',
-                        updated_at = NOW(),
-                        error_message = NULL
-                    WHERE id = %s
-                    """,
-                    (embedding, chunk_id),
-                )
-                succeeded += 1
+    return {
+        "success": True,
+        "message": f"Processed {len(pending_chunks)} chunks",
+        "processed": len(pending_chunks),
+        "succeeded": succeeded,
+        "failed": failed,
+        "failed_chunk_ids": failed_ids if failed > 0 else [],
+    }
 
-            except Exception as e:
-                error_msg = str(e)
-                print(f"Error embedding chunk {chunk_id}: {error_msg}")
 
-                # Update chunk as failed with retry count
-                cursor.execute(
-                    """
-                    UPDATE chunks 
-                    SET status = 'failed',
-                        error_message = %s,
-                        retry_count = retry_count + 1,
-                        updated_at = NOW()
-                    WHERE id = %s
-                    """,
-                    (error_msg, chunk_id),
-                )
-                failed += 1
-                failed_ids.append(chunk_id)
+@app.post("/embed")
+async def embed_pending_chunks(
+    document_id: Optional[int] = None, batch_size: int = 50, max_retries: int = 3
+):
+    """
+    Generate embeddings for chunks with status 'pending' or 'failed'
 
-        conn.commit()
-        cursor.close()
-        conn.close()
+    Args:
+        document_id: Optional - process only chunks from specific document
+        batch_size: Number of chunks to process in one batch (default: 50)
+        max_retries: Maximum retry count for failed chunks (default: 3)
 
-        print(f"Embedding complete: {succeeded} succeeded, {failed} failed")
+    Returns:
+        Status and statistics of embedding generation
+    """
+    try:
+        # Database work runs in worker threads so the event loop keeps serving
+        # /health, /retrieve, etc.; Gemini calls stay on the loop, where the
+        # SDK's cached async client is bound
+        loop = asyncio.get_running_loop()
+        conn = await loop.run_in_executor(embed_executor, db_pool.getconn)
+        try:
+            with conn.cursor() as cursor:
+                (
+                    pending_chunks,
+                    content_hashes,
+                    embeddings_by_hash,
+                    contents_to_embed,
+                ) = await loop.run_in_executor(
+                    embed_executor,
+                    fetch_pending_chunks_sync,
+                    cursor,
+                    document_id,
+                    batch_size,
+                    max_retries,
+                )
 
-        return {
-            "success": True,
-            "message": f"Processed {len(pending_chunks)} chunks",
-            "processed": len(pending_chunks),
-            "succeeded": succeeded,
-            "failed": failed,
-            "failed_chunk_ids": failed_ids if failed > 0 else [],
-        }
+                if not pending_chunks:
+                    return {
+                        "success": True,
+                        "message": "No pending chunks to process",
+                        "processed": 0,
+                        "succeeded": 0,
+                        "failed": 0,
+                    }
+
+                # Embed each remaining distinct content once, in batched API calls
+                # (failures are returned, not raised)
+                if contents_to_embed:
+                    embeddings = await aembed_batches(
+                        list(contents_to_embed.values()),
+                        task_type="retrieval_document",
+                        return_exceptions=True,
+                    )
+                    embeddings_by_hash.update(zip(contents_to_embed.keys(), embeddings))
+
+                return await loop.run_in_executor(
+                    embed_executor,
+                    store_embedding_results_sync,
+                    conn,
+                    cursor,
+                    pending_chunks,
+                    content_hashes,
+                    embeddings_by_hash,
+                )
+        finally:
+            # Uncommitted work (and the row locks) is rolled back by the pool
+            await loop.run_in_executor(embed_executor, db_pool.putconn, conn)
 
     except Exception as e:
         print(f"Error in embed_pending_chunks: {e}")
@@ -506,39 +732,35 @@ async def retry_failed_chunks(document_id: Optional[int] = None):
         Number of chunks reset for retry
     """
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        if document_id:
-            cursor.execute(
-                """
-                UPDATE chunks 
-                SET status = 'pending', 
-                    retry_count = 0, 
-                    error_message = NULL,
-                    updated_at = NOW()
-                WHERE document_id = %s AND status = 'failed'
-                RETURNING id
-                """,
-                (document_id,),
-            )
-        else:
-            cursor.execute(
-                """
-                UPDATE chunks 
-                SET status = 'pending', 
-                    retry_count = 0, 
-                    error_message = NULL,
-                    updated_at = NOW()
-                WHERE status = 'failed'
-                RETURNING id
-                """
-            )
+        with get_db_connection() as conn, conn.cursor() as cursor:
+            if document_id:
+                cursor.execute(
+                    """
+                    UPDATE chunks 
+                    SET status = 'pending', 
+                        retry_count = 0, 
+                        error_message = NULL,
+                        updated_at = NOW()
+                    WHERE document_id = %s AND status = 'failed'
+                    RETURNING id
+                    """,
+                    (document_id,),
+                )
+            else:
+                cursor.execute(
+                    """
+                    UPDATE chunks 
+                    SET status = 'pending', 
+                        retry_count = 0, 
+                        error_message = NULL,
+                        updated_at = NOW()
+                    WHERE status = 'failed'
+                    RETURNING id
+                    """
+                )
 
-        reset_chunks = cursor.fetchall()
-        conn.commit()
-        cursor.close()
-        conn.close()
+            reset_chunks = cursor.fetchall()
+            conn.commit()
 
         return {
             "success": True,
@@ -567,22 +789,30 @@ async def retrieve_chunks(request: RetrieveRequest):
     try:
         # Generate embedding for query
         print(f"Generating embedding for query: {request.query}")
-        query_embedding = embed_query(request.query)
+        query_embedding = np.asarray(
+            await aembed_query(request.query), dtype=np.float16
+        )
 
         # Search database using match_chunks function
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        cursor.execute(
-            """
-            SELECT * FROM match_chunks(%s::vector, %s, %s)
-            """,
-            (query_embedding, request.top_k, request.document_id),
-        )
+        with get_db_connection() as conn, conn.cursor() as cursor:
+            # Widen the HNSW candidate list for this transaction only, so enough
+            # neighbours survive the document/status filters (pgvector max: 1000).
+            # Sent with the search in one round-trip
+            cursor.execute(
+                """
+                SET LOCAL hnsw.ef_search = %s;
+                SELECT * FROM match_chunks(%s::halfvec, %s, %s)
+                """,
+                (
+                    min(max(request.top_k * 4, 40), 1000),
+                    query_embedding,
+                    request.top_k,
+                    request.document_id,
+                ),
+            )
 
-        results = cursor.fetchall()
-        cursor.close()
-        conn.close()
+            results = cursor.fetchall()
+            conn.commit()
 
         # Format results
         chunk_results = [
@@ -611,39 +841,34 @@ async def retrieve_chunks(request: RetrieveRequest):
 async def get_stats():
     """Get indexer statistics with chunk status breakdown"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Get document counts by status
-        cursor.execute(
-            """
-            SELECT status, COUNT(*) 
-            FROM documents 
-            GROUP BY status
-            """
-        )
-        doc_stats = dict(cursor.fetchall())
-
-        # Get chunk counts by status
-        cursor.execute(
-            """
-            SELECT status, COUNT(*) 
-            FROM chunks 
-            GROUP BY status
-            """
-        )
-        chunk_stats = dict(cursor.fetchall())
+        with get_db_connection() as conn, conn.cursor() as cursor:
+            # Get document counts by status
+            cursor.execute(
+                """
+                SELECT status, COUNT(*) 
+                FROM documents 
+                GROUP BY status
+                """
+            )
+            doc_stats = dict(cursor.fetchall())
 
-        # Get total chunks
-        cursor.execute("SELECT COUNT(*) FROM chunks")
-        total_chunks = cursor.fetchone()[0]
+            # Get chunk counts by status
+            cursor.execute(
+                """
+                SELECT status, COUNT(*) 
+                FROM chunks 
+                GROUP BY status
+                """
+            )
+            chunk_stats = dict(cursor.fetchall())
 
-        # Get chunks with embeddings
-        cursor.execute("SELECT COUNT(*) FROM chunks WHERE embedding IS NOT NULL")
-        chunks_with_embeddings = cursor.fetchone()[0]
+            # Get total chunks
+            cursor.execute("SELECT COUNT(*) FROM chunks")
+            total_chunks = cursor.fetchone()[0]
 
-        cursor.close()
-        conn.close()
+            # Get chunks with embeddings
+            cursor.execute("SELECT COUNT(*) FROM chunks WHERE embedding IS NOT NULL")
+            chunks_with_embeddings = cursor.fetchone()[0]
 
         return {
             "documents": doc_stats,
@@ -670,41 +895,35 @@ async def get_chunk_details(chunk_id: int):
         Chunk details with embedding vector
     """
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        cursor.execute(
-            """
-            SELECT 
-                id, 
-                document_id, 
-                content, 
-                chunk_index, 
-                status,
-                embedding,
-                retry_count,
-                error_message,
-                created_at,
-                updated_at
-            FROM chunks 
-            WHERE id = %s
-            """,
-            (chunk_id,),
-        )
+        with get_db_connection() as conn, conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT 
+                    id, 
+                    document_id, 
+                    content, 
+                    chunk_index, 
+                    status,
+                    embedding,
+                    retry_count,
+                    error_message,
+                    created_at,
+                    updated_at
+                FROM chunks 
+                WHERE id = %s
+                """,
+                (chunk_id,),
+            )
 
-        result = cursor.fetchone()
-        cursor.close()
-        conn.close()
+            result = cursor.fetchone()
 
         if not result:
             raise HTTPException(status_code=404, detail=f"Chunk {chunk_id} not found")
 
-        # Parse embedding (PostgreSQL vector to Python list)
+        # Convert embedding (HalfVector via pgvector) to Python list
         embedding_vector = None
-        if result[5]:  # If embedding exists
-            # Convert pgvector to list
-            embedding_str = result[5].strip("[]")
-            embedding_vector = [float(x) for x in embedding_str.split(",")]
+        if result[5] is not None:  # If embedding exists
+            embedding_vector = result[5].to_list()
 
         chunk_data = {
             "id": result[0],
@@ -746,19 +965,15 @@ async def get_chunk_embedding_only(chunk_id: int):
         Raw embedding vector as array of floats
     """
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        with get_db_connection() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT embedding FROM chunks WHERE id = %s", (chunk_id,))
 
-        cursor.execute("SELECT embedding FROM chunks WHERE id = %s", (chunk_id,))
-
-        result = cursor.fetchone()
-        cursor.close()
-        conn.close()
+            result = cursor.fetchone()
 
         if not result:
             raise HTTPException(status_code=404, detail=f"Chunk {chunk_id} not found")
 
-        if not result[0]:
+        if result[0] is None:
             return {
                 "chunk_id": chunk_id,
                 "embedding": None,
@@ -766,8 +981,7 @@ async def get_chunk_embedding_only(chunk_id: int):
             }
 
         # Convert pgvector to list
-        embedding_str = result[0].strip("[]")
-        embedding_vector = [float(x) for x in embedding_str.split(",")]
+        embedding_vector = result[0].to_list()
 
         return {
             "chunk_id": chunk_id,
@@ -802,20 +1016,14 @@ async def compare_embeddings(chunk_id1: int, chunk_id2: int):
         Comparison of two embeddings with cosine similarity
     """
     try:
-        import numpy as np
-
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Get both embeddings
-        cursor.execute(
-            "SELECT id, content, embedding FROM chunks WHERE id IN (%s, %s)",
-            (chunk_id1, chunk_id2),
-        )
+        with get_db_connection() as conn, conn.cursor() as cursor:
+            # Get both embeddings
+            cursor.execute(
+                "SELECT id, content, embedding FROM chunks WHERE id IN (%s, %s)",
+                (chunk_id1, chunk_id2),
+            )
 
-        results = cursor.fetchall()
-        cursor.close()
-        conn.close()
+            results = cursor.fetchall()
 
         if len(results) != 2:
             raise HTTPException(status_code=404, detail="One or both chunks not found")
@@ -823,13 +1031,12 @@ async def compare_embeddings(chunk_id1: int, chunk_id2: int):
         # Parse embeddings
         chunks_data = []
         for row in results:
-            if not row[2]:
+            if row[2] is None:
                 raise HTTPException(
                     status_code=400, detail=f"Chunk {row[0]} has no embedding"
                 )
 
-            embedding_str = row[2].strip("[]")
-            embedding = [float(x) for x in embedding_str.split(",")]
+            embedding = row[2].to_list()
             chunks_data.append(
                 {
                     "id": row[0],